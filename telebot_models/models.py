@@ -1,9 +1,14 @@
-from typing import Any, Callable, ClassVar, Generic, Optional, Type, TypeVar
+import asyncio
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Awaitable, Callable, ClassVar, Generic, Iterable, Optional, Type, TypeVar
 
 from bson import ObjectId
+from bson.errors import InvalidId
 from motor import core
 from pydantic import BaseModel, Field, PrivateAttr
-from pymongo.results import DeleteResult, InsertOneResult, UpdateResult
+from pymongo import UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
 from typing_extensions import Self
 
 
@@ -15,10 +20,16 @@ class PyObjectId(ObjectId):
         yield cls.validate
 
     @classmethod
-    def validate(cls, value: str) -> ObjectId:
-        if not ObjectId.is_valid(value):
+    def validate(cls, value: Any) -> ObjectId:
+        if isinstance(value, ObjectId):
+            return value
+        if value is None:
+            # ObjectId(None) would generate a new id
             raise ValueError("Invalid objectid")
-        return ObjectId(value)
+        try:
+            return ObjectId(value)
+        except (InvalidId, TypeError) as e:
+            raise ValueError("Invalid objectid") from e
 
     @classmethod
     def __modify_schema__(cls, field_schema: Any) -> None:
@@ -41,7 +52,6 @@ class ModelConfig:
         """The base model config"""
 
         use_enum_values = True
-        arbitrary_types_allowed = True
         json_encoders = {ObjectId: str}
 
 
@@ -51,10 +61,30 @@ class Model(ModelConfig, BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias='_id')
     manager: ClassVar[Type['BaseModelManager']]
 
-    class _CustomCache:
-        """Cache"""
+    __custom_cache__: dict = PrivateAttr(default_factory=dict)
+    # Loaded with a projection, only fields in `__fields_set__` are known
+    __projected__: bool = PrivateAttr(default=False)
+    _from_doc: ClassVar[Callable[[dict], 'Model']]
+    _relation_loaders: ClassVar[dict[str, Callable[[list['Model']], Awaitable[None]]]]
 
-    __custom_cache__: _CustomCache = PrivateAttr(default_factory=_CustomCache)
+    @classmethod
+    def _get_relation_loaders(cls) -> dict[str, Callable[[list['Model']], Awaitable[None]]]:
+        if '_relation_loaders' not in vars(cls):
+            cls._relation_loaders = dict(getattr(cls, '_relation_loaders', {}))
+        return cls._relation_loaders
+
+    @classmethod
+    async def prefetch_relations(cls, objs: list['Model'], *rel_names: str) -> None:
+        """Load related objects for all `objs` with one query per relation, all relations by default"""
+        loaders = cls._get_relation_loaders()
+        await asyncio.gather(*(loaders[rel_name](objs) for rel_name in rel_names or loaders))
+
+    async def gather_attrs(self, *names: str) -> list:
+        """Await related object accessors concurrently"""
+        return list(await asyncio.gather(*(getattr(self, name)() for name in names)))
+
+    def _to_bson_doc(self, exclude_id: bool = False, exclude_unset: bool = False) -> dict:
+        return _to_document(self, exclude_id=exclude_id, exclude_unset=exclude_unset)
 
     async def update(self, **kwargs) -> None:
         await self.manager.update(self, **kwargs)
@@ -68,6 +98,75 @@ class Model(ModelConfig, BaseModel):
 
 T = TypeVar('T', bound=Model)
 
+_alias_maps: dict[type, dict[str, str]] = {}
+
+
+def _get_alias_map(model_cls: Type[BaseModel]) -> dict[str, str]:
+    alias_map = _alias_maps.get(model_cls)
+    if alias_map is None:
+        alias_map = _alias_maps[model_cls] = {name: field.alias for name, field in model_cls.__fields__.items()}
+    return alias_map
+
+
+def _compile_from_doc(model_cls: Type[BaseModel]) -> classmethod:
+    """Generate `construct` specialized for the fields of `model_cls`, taking a Mongo document"""
+    lines = ['def _from_doc(cls, document):', '    values = {}', '    fields_set = set()']
+    for name, field in model_cls.__fields__.items():
+        lines += [
+            f'    if {field.alias!r} in document:',
+            f'        values[{name!r}] = document[{field.alias!r}]',
+            f'        fields_set.add({name!r})',
+        ]
+        if not field.required:
+            lines += ['    else:', f'        values[{name!r}] = fields[{name!r}].get_default()']
+    lines += [
+        '    model = cls.__new__(cls)',
+        "    object_setattr(model, '__dict__', values)",
+        "    object_setattr(model, '__fields_set__', fields_set)",
+        '    model._init_private_attributes()',
+        '    return model',
+    ]
+    namespace = {'fields': model_cls.__fields__, 'object_setattr': object.__setattr__}
+    exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+    return classmethod(namespace['_from_doc'])
+
+
+_bson_scalar_types = {str, int, float, bool, type(None), ObjectId, PyObjectId, datetime}
+
+
+def _to_document_value(value: Any, use_enum_values: bool) -> Any:
+    # pylint: disable=too-many-return-statements
+    if value.__class__ in _bson_scalar_types:
+        return value
+    if isinstance(value, Model):
+        return value._to_bson_doc()  # pylint: disable=protected-access
+    if isinstance(value, BaseModel):
+        return _to_document(value)
+    if isinstance(value, dict):
+        return {k: _to_document_value(v, use_enum_values) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = (_to_document_value(v, use_enum_values) for v in value)
+        if isinstance(value, tuple) and hasattr(value, '_fields'):
+            return value.__class__(*items)
+        return value.__class__(items)
+    if use_enum_values and isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _to_document(model: BaseModel, exclude_id: bool = False, exclude_unset: bool = False) -> dict:
+    """Same as `model.dict(by_alias=True)`, but reads `__dict__` directly"""
+    if model.__exclude_fields__:
+        return model.dict(by_alias=True, exclude_unset=exclude_unset, exclude={'id'} if exclude_id else None)
+    alias_map = _get_alias_map(model.__class__)
+    use_enum_values = getattr(model.Config, 'use_enum_values', False)
+    values = model.__dict__
+    if exclude_unset:
+        values = {k: v for k, v in values.items() if k in model.__fields_set__}
+    return {
+        alias_map[k]: _to_document_value(v, use_enum_values) for k, v in values.items() if not exclude_id or k != 'id'
+    }
+
 
 class ModelManagerMeta(type):
     """Model Manager Meta"""
@@ -75,7 +174,15 @@ class ModelManagerMeta(type):
     def __new__(mcs, name, bases, dct):  # noqa
         # pylint: disable=bad-mcs-classmethod-argument
         manager = super().__new__(mcs, name, bases, dct)
-        manager.model.manager = manager  # noqa
+        manager._relation_map = list(getattr(manager, '_relation_map', []))  # noqa
+        manager.index_hints = dict(getattr(manager, 'index_hints', {}))  # noqa
+        if dct.get('model') is not None:
+            # The first manager declared for a model stays bound to it
+            if 'manager' not in vars(manager.model):
+                manager.model.manager = manager  # noqa
+            if '_from_doc' not in vars(manager.model):
+                manager.model._from_doc = _compile_from_doc(manager.model)  # noqa
+            manager._alias_map = _get_alias_map(manager.model)  # noqa
         return manager
 
 
@@ -84,6 +191,14 @@ class BaseModelManager(Generic[T], metaclass=ModelManagerMeta):
 
     model: Type[T] = Model
     collection: str = ''
+    # Build models from fetched documents without validation
+    trust_db_documents: bool = False
+    # Fetch only these model fields by default, the rest must have defaults.
+    # Models fetched with a projection are updated with the fetched and assigned fields only
+    fetch_fields: set[str] | None = None
+    # Index to hint for queries filtering by exactly these document keys
+    index_hints: dict[frozenset[str], str] = {}
+    _alias_map: dict[str, str]
     _relation_map: list[tuple[type, str, str]]
 
     def __init__(self, document_filter: dict | None = None):
@@ -91,8 +206,6 @@ class BaseModelManager(Generic[T], metaclass=ModelManagerMeta):
 
     @classmethod
     def _get_relation_map(cls) -> list[tuple[type, str, str]]:
-        if not hasattr(cls, '_relation_map'):
-            cls._relation_map = []
         return cls._relation_map
 
     @classmethod
@@ -110,21 +223,31 @@ class BaseModelManager(Generic[T], metaclass=ModelManagerMeta):
                 return self.filter({field_name: obj_id})
 
             async def obj(self: Model):
-                __cached_key__ = '__cached_' + rel_obj_name + '__'
-                if getattr(self.__custom_cache__, __cached_key__, None) is None:
-                    setattr(self.__custom_cache__, __cached_key__, await cls().find_one(getattr(self, field_name)))
-                return getattr(self.__custom_cache__, __cached_key__)
+                cache = self.__custom_cache__
+                value = cache.get(rel_obj_name)
+                if value is None:
+                    value = cache[rel_obj_name] = await cls().find_one(getattr(self, field_name))
+                return value
+
+            async def prefetch(objs: list[Model]) -> None:
+                obj_ids = list({getattr(obj, field_name) for obj in objs} - {None})
+                if not obj_ids:
+                    return
+                found = {related.id: related for related in await cls({'_id': {'$in': obj_ids}}).find_all()}
+                for obj in objs:
+                    obj.__custom_cache__[rel_obj_name] = found.get(getattr(obj, field_name))
 
             setattr(cls.model, model_cls.__name__.lower() + '_set', related_model_set)
             setattr(model_cls.manager, 'by_' + rel_obj_name, by_related_obj)
             setattr(model_cls, rel_obj_name, obj)
+            model_cls._get_relation_loaders()[rel_obj_name] = prefetch  # pylint: disable=protected-access
             return model_cls
 
         return decorator
 
     @classmethod
     def get_collection(cls) -> core.AgnosticCollection:
-        return CollectionGetter.get_collection(cls.collection)
+        return CollectionGetter.get_collection_cached(cls.collection)
 
     @classmethod
     async def insert(cls, model: T, **kwargs) -> InsertOneResult:
@@ -132,12 +255,11 @@ class BaseModelManager(Generic[T], metaclass=ModelManagerMeta):
         exclude: set | None = kwargs.get('exclude')
 
         if include:
-            exclude = None
+            document = model.dict(by_alias=True, include=include)
+        elif exclude:
+            document = model.dict(by_alias=True, exclude={*exclude, 'id'})
         else:
-            exclude = exclude or set()
-            exclude.add('id')
-
-        document = model.dict(by_alias=True, exclude=exclude, include=include)
+            document = model._to_bson_doc(exclude_id=True)  # pylint: disable=protected-access
         result = await cls.get_collection().insert_one(document)
         model.id = document['_id']
         return result
@@ -146,64 +268,238 @@ class BaseModelManager(Generic[T], metaclass=ModelManagerMeta):
     async def update(cls, model: T, **kwargs) -> UpdateResult:
         include: set | None = kwargs.pop('include', None)
         exclude: set | None = kwargs.pop('exclude', None)
+        # Fields a projection did not fetch hold defaults, they must not overwrite stored values
+        exclude_unset = model.__projected__
 
         if include:
-            exclude = None
+            document = model.dict(by_alias=True, include=include)
+        elif exclude:
+            document = model.dict(by_alias=True, exclude={*exclude, 'id'}, exclude_unset=exclude_unset)
         else:
-            exclude = exclude or set()
-            exclude.add('id')
+            document = model._to_bson_doc(  # pylint: disable=protected-access
+                exclude_id=True, exclude_unset=exclude_unset
+            )
 
-        return await cls.get_collection().update_one(
-            {'_id': model.id},
-            {'$set': model.dict(by_alias=True, exclude=exclude, include=include)},
-            **kwargs,
-        )
+        return await cls.get_collection().update_one({'_id': model.id}, {'$set': document}, **kwargs)
+
+    @classmethod
+    async def insert_many(cls, models: list[T], ordered: bool = False, **kwargs) -> InsertManyResult:
+        if not models:
+            return InsertManyResult([], acknowledged=True)
+        documents = [model._to_bson_doc(exclude_id=True) for model in models]  # pylint: disable=protected-access
+        result = await cls.get_collection().insert_many(documents, ordered=ordered, **kwargs)
+        for model, document in zip(models, documents):
+            model.id = document['_id']
+        return result
+
+    @classmethod
+    async def bulk_update(cls, updates: list[tuple[T, dict]], ordered: bool = False, **kwargs) -> BulkWriteResult:
+        if not updates:
+            return BulkWriteResult(
+                {
+                    'writeErrors': [],
+                    'writeConcernErrors': [],
+                    'nInserted': 0,
+                    'nUpserted': 0,
+                    'nMatched': 0,
+                    'nModified': 0,
+                    'nRemoved': 0,
+                    'upserted': [],
+                },
+                acknowledged=True,
+            )
+        operations = [UpdateOne({'_id': model.id}, {'$set': patch}) for model, patch in updates]
+        return await cls.get_collection().bulk_write(operations, ordered=ordered, **kwargs)
 
     async def update_many(self, *args, **kwargs) -> UpdateResult:
         return await self.get_collection().update_many(self.document_filter, *args, **kwargs)
 
     @classmethod
     async def delete(cls, model: T) -> DeleteResult:
-        _cls: Type[Model]
-        for _cls, field_name, model_field_name in cls._get_relation_map():
-            objs = await _cls.manager({field_name: getattr(model, model_field_name)}).find_all()
-            for obj in objs:
-                await obj.delete()
+        # Direct children are matched by the model's own values, the stored document may be gone or stale
+        await asyncio.gather(
+            *(
+                cls._delete_related(_cls, field_name, [getattr(model, model_field_name)])
+                for _cls, field_name, model_field_name in cls._get_relation_map()
+            )
+        )
         return await cls.get_collection().delete_one({'_id': model.id})
 
+    @classmethod
+    def _has_delete_hooks(cls) -> bool:
+        return cls.delete.__func__ is not BaseModelManager.delete.__func__ or cls.model.delete is not Model.delete
+
+    async def _delete_related_documents(self) -> None:
+        """
+        Delete documents related to the filtered ones with a single aggregation.
+        Related collections from the same database are joined with `$lookup`,
+        the related documents found for one filtered document must fit in a 16MB document.
+        Related collections from other databases are matched by the fetched field values.
+        """
+        collection = self.get_collection()
+        relation_map = self._get_relation_map()
+        pipeline: list[dict] = [{'$match': self.document_filter}]
+        project = {'_id': 0}
+        related_filters = []
+        for i, (_cls, field_name, model_field_name) in enumerate(relation_map):
+            local_field = self._alias_map[model_field_name]
+            related_collection = _cls.manager.get_collection()
+            if related_collection.database == collection.database:
+                pipeline.append(
+                    {
+                        '$lookup': {
+                            'from': related_collection.name,
+                            'localField': local_field,
+                            'foreignField': field_name,
+                            'as': f'related_{i}',
+                        }
+                    }
+                )
+                project[f'related_{i}'] = f'$related_{i}._id'
+                related_filters.append((_cls, '_id', True))
+            else:
+                project[f'related_{i}'] = '$' + local_field
+                related_filters.append((_cls, field_name, False))
+        pipeline.append({'$project': project})
+        documents = await collection.aggregate(pipeline).to_list(None)
+        if not documents:
+            return
+        await asyncio.gather(
+            *(
+                self._delete_related(
+                    _cls,
+                    key,
+                    [value for document in documents for value in document[f'related_{i}']]
+                    if is_lookup
+                    else [document.get(f'related_{i}') for document in documents],
+                )
+                for i, (_cls, key, is_lookup) in enumerate(related_filters)
+            )
+        )
+
+    @staticmethod
+    async def _delete_related(model_cls: Type[Model], key: str, values: list) -> None:
+        # pylint: disable=protected-access
+        if not values:
+            return
+        manager = model_cls.manager({key: {'$in': values}})
+        if model_cls.manager._has_delete_hooks():
+            await asyncio.gather(*(obj.delete() for obj in await manager.find_all()))
+            return
+        if model_cls.manager._get_relation_map():
+            await manager._delete_related_documents()
+        await manager.delete_many()
+
     async def delete_many(self, *args, **kwargs) -> DeleteResult:
         return await self.get_collection().delete_many(self.document_filter, *args, **kwargs)
 
     def filter(self, document_filter: dict | None = None) -> Self:
-        document_filter = document_filter or {}
-        return self.__class__({**self.document_filter, **document_filter})
+        if not document_filter:
+            return self.__class__(self.document_filter.copy())
+        return self.__class__(self.document_filter | document_filter)
+
+    def _parse_document(self, document: dict, projected: bool = False) -> T:
+        if self.trust_db_documents:
+            model = self.model._from_doc(document)  # pylint: disable=protected-access
+        else:
+            model = self.model.parse_obj(document)
+        if projected:
+            model.__projected__ = True
+        return model
+
+    def _set_hint(self, kwargs: dict) -> None:
+        if self.index_hints and 'hint' not in kwargs:
+            hint = self.index_hints.get(frozenset(self.document_filter))
+            if hint is not None:
+                kwargs['hint'] = hint
+
+    @staticmethod
+    def _is_projected(args: tuple, kwargs: dict) -> bool:
+        return kwargs.get('projection') is not None or bool(args and args[0] is not None)
+
+    def _get_projection(self, projection: dict | set | list | None) -> dict | None:
+        """Mongo projection by model field names, `_id` is always fetched"""
+        if projection is None:
+            projection = self.fetch_fields
+        if projection is None or isinstance(projection, dict):
+            return projection
+        return {'_id': 1, **{self._alias_map.get(name, name): 1 for name in projection}}
+
+    async def iter_all(
+        self, *args, batch_size: int = 1000, projection: dict | set | list | None = None, **kwargs
+    ) -> AsyncIterator[T]:
+        """Yield models as the cursor receives them, preferred over `find_all` for large result sets"""
+        if projection is not None or not args:
+            kwargs['projection'] = self._get_projection(projection)
+        self._set_hint(kwargs)
+        projected = self._is_projected(args, kwargs)
+        cursor = self.get_collection().find(self.document_filter, *args, **kwargs).batch_size(batch_size)
+        async for document in cursor:
+            yield self._parse_document(document, projected)
 
     async def find_all(self, *args, **kwargs) -> list[T]:
-        return [
-            self.model.parse_obj(obj)
-            for obj in await self.get_collection().find(self.document_filter, *args, **kwargs).to_list(None)
-        ]
+        return [model async for model in self.iter_all(*args, **kwargs)]
 
-    async def find_one(self, *args, raise_exception=True, **kwargs) -> Optional[T]:
+    async def find_one(
+        self, *args, raise_exception=True, projection: dict | set | list | None = None, **kwargs
+    ) -> Optional[T]:
+        document_filter = self.document_filter
         if args and isinstance(args[0], ObjectId):
-            self.document_filter.update({'_id': args[0]})
+            document_filter = {**document_filter, '_id': args[0]} if document_filter else {'_id': args[0]}
             args = args[1:]
-        document = await self.get_collection().find_one(self.document_filter, *args, **kwargs)
+        if projection is not None or not args:
+            kwargs['projection'] = self._get_projection(projection)
+        document = await self.get_collection().find_one(document_filter, *args, **kwargs)
         if document is None and raise_exception:
-            raise ValueError(f'Document not found by filter {self.document_filter}')
+            raise ValueError(f'Document not found by filter {document_filter}')
         if document is None:
             return None
-        return self.model.parse_obj(document)
+        return self._parse_document(document, self._is_projected(args, kwargs))
+
+    async def count(self, **kwargs) -> int:
+        self._set_hint(kwargs)
+        return await self.get_collection().count_documents(self.document_filter, **kwargs)
 
-    async def count(self) -> int:
-        return await self.get_collection().count_documents(self.document_filter)
+    @classmethod
+    async def estimated_count(cls, **kwargs) -> int:
+        """Count of all documents in the collection from its metadata"""
+        return await cls.get_collection().estimated_document_count(**kwargs)
 
 
 class CollectionGetter:
+    _cache: dict[str, core.AgnosticCollection] = {}
+    _warmup_task: Optional[asyncio.Task] = None
+
     @staticmethod
     def get_collection(collection: str) -> core.AgnosticCollection:
         raise NotImplementedError(f'Not implemented for {collection}')
 
-
-def set_collection_getter(func: Callable[[str], core.AgnosticCollection]) -> None:
+    @classmethod
+    def get_collection_cached(cls, collection: str) -> core.AgnosticCollection:
+        handle = cls._cache.get(collection)
+        if handle is None:
+            handle = cls._cache[collection] = cls.get_collection(collection)
+        return handle
+
+
+async def warmup_collections(collections: Iterable[str]) -> None:
+    """Resolve collections and ping their databases to open pool connections"""
+    databases = {}
+    for collection in collections:
+        database = CollectionGetter.get_collection_cached(collection).database
+        databases.setdefault(database.name, database)
+    await asyncio.gather(*(database.command('ping') for database in databases.values()))
+
+
+def set_collection_getter(
+    func: Callable[[str], core.AgnosticCollection],
+    warmup: Iterable[str] | None = None,
+) -> Optional[asyncio.Task]:
+    """Set the collection getter, `warmup` requires a running loop to schedule `warmup_collections`"""
     CollectionGetter.get_collection = func
+    CollectionGetter._cache.clear()  # pylint: disable=protected-access
+    if warmup is None:
+        return None
+    task = asyncio.get_running_loop().create_task(warmup_collections(warmup))
+    CollectionGetter._warmup_task = task  # pylint: disable=protected-access
+    return task